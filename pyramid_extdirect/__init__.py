@@ -2,15 +2,27 @@
 ExtDirect implementation for Pyramid
 """
 from collections import defaultdict
+import datetime
+import decimal
 import json
 import logging
+import re
+import sys
+import threading
+import time
 import traceback
+import uuid
 try:
     from html.entities import entitydefs  # Python 3
 except ImportError:
     from htmlentitydefs import entitydefs  # Python 2
+try:
+    import queue  # Python 3
+except ImportError:
+    import Queue as queue  # Python 2
 
 from pyramid.security import has_permission
+from pyramid.threadlocal import manager
 from pyramid.view import render_view_to_response
 from webob import Response
 from zope.interface import implementer
@@ -21,6 +33,7 @@ __version__ = '0.5.1'
 
 
 LOG = logging.getLogger(__name__)
+CALL_LOG = logging.getLogger(__name__ + '.calls')
 
 # form parameters sent by ExtDirect when using a form-submit
 # see http://www.sencha.com/products/js/direct.php
@@ -43,15 +56,254 @@ JS_API_TPL = """var Ext = Ext || {{}};
 Ext.ns('{namespace}'); {descriptor} = {api};
 """
 
+# max. number of permission filtered API descriptors kept in cache, once
+# exceeded the whole cache is dropped
+API_CACHE_SIZE = 256
+
+# adaptive batching: weight of a new sample in the moving average of a
+# method's call duration and the number of samples needed before a
+# method is considered slow
+LATENCY_AVG_WEIGHT = 0.2
+LATENCY_MIN_SAMPLES = 10
+
+# includeme(..) settings passed to Extdirect, all of them can be set
+# globally (pyramid_extdirect.<name>) or per provider
+# (pyramid_extdirect.<provider>.<name>)
+SETTING_NAMES = (
+    "api_path", "router_path", "namespace", "descriptor",
+    "expose_exceptions", "debug_mode", "json_encoder",
+    "filter_api_by_permission", "timeout", "enable_buffer",
+    "max_retries", "client_timeout", "adaptive_batching",
+    "slow_call_threshold", "async_logging", "log_queue_size",
+    "max_workers",
+)
+
+# names of providers end up in JS identifiers
+PROVIDER_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# includeme(..) settings that need conversion
+BOOL_SETTINGS = frozenset([
+    "expose_exceptions",
+    "debug_mode",
+    "filter_api_by_permission",
+    "adaptive_batching",
+    "async_logging",
+])
+INT_SETTINGS = frozenset([
+    "max_retries",
+    "client_timeout",
+    "log_queue_size",
+    "max_workers",
+])
+FLOAT_SETTINGS = frozenset(["timeout", "slow_call_threshold"])
+
 
 def _mk_cb_key(action_name, method_name):
     """ helper function to create a unique actions dict key """
     return action_name + '#' + method_name
 
 
+# holds the deadline of the extdirect call running in the current thread
+_call_state = threading.local()
+
+
+def current_deadline():
+    """
+    Returns the deadline (as ``time.time()`` value) of the extdirect call
+    running in the current thread or None if the call has no time budget
+    """
+    return getattr(_call_state, 'deadline', None)
+
+
+class _Call(object): # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    """ A single, resolved call of a (possibly batched) request """
+
+    def __init__(self, action_name, method_name, trans_id):
+        self.action_name = action_name
+        self.method_name = method_name
+        self.trans_id = trans_id
+        self.callback = None
+        self.params = None
+        self.permission_ok = True
+        self.timeout = None
+        self.deadline = None
+        self.task = None
+        self.started = None
+        self.finished = None
+
+
+def _run_call(call, request):
+    """
+    Runs a call with time budget in a worker thread, the request and
+    registry are made available through pyramid's threadlocals
+    """
+    _call_state.deadline = call.deadline
+    manager.push({'request': request, 'registry': request.registry})
+    try:
+        return call.callback(*call.params)
+    finally:
+        manager.pop()
+        _call_state.deadline = None
+        call.finished = time.time()
+
+
+class _Task(object): # pylint: disable=too-few-public-methods
+    """ A function submitted to a ``_WorkerPool`` """
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exception = None
+        self.done = threading.Event()
+        self._started = False
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """ Cancels the task if it's not running yet, returns True if so """
+        with self._lock:
+            if not self._started:
+                self._cancelled = True
+            return self._cancelled
+
+    def run(self):
+        """ Runs the task unless it was cancelled """
+        with self._lock:
+            if self._cancelled:
+                return
+            self._started = True
+        try:
+            self.result = self.func(*self.args)
+        except Exception as exc: # pylint: disable=broad-except
+            self.exception = exc
+        finally:
+            self.done.set()
+
+
+class _WorkerPool(object):
+    """
+    A pool of at most ``max_workers`` threads, started on demand. The
+    threads are daemons, so calls exceeding their budget don't keep the
+    process from exiting.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._tasks = queue.Queue()
+        self._workers = []
+        # number of workers waiting for a task that isn't queued yet and
+        # number of queued tasks no worker is available for
+        self._idle = 0
+        self._backlog = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """ Queues ``func(*args)`` and returns its ``_Task`` """
+        task = _Task(func, args)
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            else:
+                self._backlog += 1
+        self._tasks.put(task)
+        return task
+
+    def shutdown(self):
+        """ Lets all workers exit once they're done with their task """
+        with self._lock:
+            for _ in self._workers:
+                self._tasks.put(None)
+            self._workers = []
+            self._idle = self._backlog = 0
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task.run()
+            with self._lock:
+                if self._backlog:
+                    self._backlog -= 1
+                else:
+                    self._idle += 1
+
+
+def _call_json_repr(obj):
+    """ serializer for classes that support json_repr() """
+    return obj.json_repr()
+
+
+def _isoformat(obj):
+    """ serializer for date/time objects """
+    return obj.isoformat()
+
+
+# serializers every SerializerRegistry starts with
+DEFAULT_SERIALIZERS = (
+    (datetime.datetime, _isoformat),
+    (datetime.date, _isoformat),
+    (datetime.time, _isoformat),
+    (decimal.Decimal, str),
+    (uuid.UUID, str),
+    (set, list),
+    (frozenset, list),
+)
+
+
+class SerializerRegistry(object):
+    """
+    Maps types to functions returning a JSON serializable representation
+    of their instances. Serializers are resolved along the MRO of a type
+    once, the result is cached per type.
+    """
+
+    def __init__(self, serializers=DEFAULT_SERIALIZERS):
+        self._serializers = dict(serializers)
+        self._cache = dict()
+
+    def add(self, type_, serializer):
+        """ Registers ``serializer`` for ``type_`` and its subclasses """
+        self._serializers[type_] = serializer
+        self._cache.clear()
+
+    def get(self, type_):
+        """ Returns the serializer for ``type_`` or None """
+        try:
+            return self._cache[type_]
+        except KeyError:
+            pass
+        serializer = None
+        for klass in type_.__mro__:
+            if klass in self._serializers:
+                serializer = self._serializers[klass]
+                break
+        else:
+            if hasattr(type_, 'json_repr'):
+                serializer = _call_json_repr
+        self._cache[type_] = serializer
+        return serializer
+
+
 class JsonReprEncoder(json.JSONEncoder):
-    """ a convenience wrapper for classes that support json_repr() """
+    """
+    a convenience wrapper for classes that support json_repr(), if the
+    ``serializers`` registry is set it's consulted first
+    """
+
+    serializers = None
+
     def default(self, obj):
+        if self.serializers is not None:
+            serializer = self.serializers.get(type(obj))
+            if serializer is not None:
+                return serializer(obj)
         if isinstance(obj, Response) and obj.content_type == 'application/json':
             # return decoded response body in case it's an already
             # rendered exception view
@@ -62,6 +314,95 @@ class JsonReprEncoder(json.JSONEncoder):
         return json_repr()
 
 
+class CallLogger(object):
+    """
+    Writes call and error log records from a background thread, so slow
+    log handlers don't add to the request latency. Records are put into a
+    queue holding at most ``maxsize`` entries, records that don't fit are
+    dropped and counted in ``dropped``. Records that can't be emitted
+    (e.g. because formatting fails) are counted in ``failed``.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.failed = 0
+        self._reported = (0, 0)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # the thread is started lazily, this way forked worker
+        # processes get their own one
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _put(self, record):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def access(self, action, method, tid, duration, size, outcome):
+        """ Queues a record of a finished call """
+        self._put(('access', dict(
+            action=action,
+            method=method,
+            tid=tid,
+            duration=duration,
+            size=size,
+            outcome=outcome
+        )))
+
+    def error(self, action, method, tid, exc_info):
+        """ Queues a record of a failed call, ``exc_info`` is
+            formatted in the background thread
+        """
+        self._put(('error', dict(
+            action=action,
+            method=method,
+            tid=tid,
+            exc_info=exc_info
+        )))
+
+    def _emit(self, kind, record):
+        if kind == 'access':
+            CALL_LOG.info(
+                "%s.%s tid=%s outcome=%s duration=%.3fs size=%s",
+                record['action'], record['method'], record['tid'],
+                record['outcome'], record['duration'], record['size'],
+                extra=record)
+            return
+        (exc_class, exc, exc_tb) = record.pop('exc_info')
+        LOG.error("%s: %s", exc_class.__name__, exc, extra=record)
+        LOG.info(''.join(traceback.format_exception(exc_class, exc, exc_tb)))
+
+    def _run(self):
+        while True:
+            (kind, record) = self.queue.get()
+            try:
+                self._emit(kind, record)
+            except Exception: # pylint: disable=broad-except
+                self.failed += 1
+            try:
+                counts = (self.dropped, self.failed)
+                if counts != self._reported:
+                    self._reported = counts
+                    LOG.warning("call log records dropped so far: %d, failed: %d",
+                                *counts)
+            except Exception: # pylint: disable=broad-except
+                pass
+            finally:
+                self.queue.task_done()
+
+
 class IExtdirect(Interface):
     """ marker iface for Extdirect utility """
     pass
@@ -71,6 +412,11 @@ class AccessDeniedException(Exception):
     """ marker exception for failed permission checks """
     pass
 
+
+class CallTimeoutException(Exception):
+    """ marker exception for calls exceeding their time budget """
+    pass
+
 @implementer(IExtdirect)
 class Extdirect(object):
     """
@@ -103,6 +449,35 @@ class Extdirect(object):
     response object pointing to a structure that can be used in pyramid
     debug toolbar.
 
+    If ``filter_api_by_permission`` is set to True, the API only
+    contains methods the requesting principals are permitted to call,
+    see ``get_permitted_actions``.
+
+    Methods can opt in to a time budget using their own ``timeout``
+    (in seconds), ``timeout=True`` uses the ``timeout`` argument as
+    budget. Calls with a budget run concurrently in a pool of at most
+    ``max_workers`` threads, i.e. off the request thread. A call running
+    longer is answered with an exception result while the rest of the
+    batch is delivered.
+
+    The ``enable_buffer``, ``max_retries`` and ``client_timeout``
+    arguments are passed to the client as ``enableBuffer``,
+    ``maxRetries`` and ``timeout`` provider options. Methods can be
+    excluded from client side batching with ``batched=False``.
+
+    If ``adaptive_batching`` is set to True, call durations are tracked
+    and methods that take longer than ``slow_call_threshold`` seconds
+    on average are declared as not batched.
+
+    If ``async_logging`` is set to True, every call is logged (action,
+    method, tid, duration, size of its response and outcome) and errors are
+    logged by a background thread, see ``CallLogger``.
+    ``log_queue_size`` limits the number of pending log records.
+
+    Additional types can be made JSON serializable using
+    ``add_serializer``, this only works with ``json_encoder`` being
+    a ``JsonReprEncoder`` (sub)class.
+
     See http://www.sencha.com/products/js/direct.php for further infos.
 
     The optional ``expose_exceptions`` argument controls the output of
@@ -116,7 +491,17 @@ class Extdirect(object):
                  descriptor='Ext.app.REMOTING_API',
                  expose_exceptions=True,
                  debug_mode=False,
-                 json_encoder=JsonReprEncoder):
+                 json_encoder=JsonReprEncoder,
+                 filter_api_by_permission=False,
+                 timeout=None,
+                 enable_buffer=None,
+                 max_retries=None,
+                 client_timeout=None,
+                 adaptive_batching=False,
+                 slow_call_threshold=1.0,
+                 async_logging=False,
+                 log_queue_size=1000,
+                 max_workers=10):
         self.api_path = api_path
         self.router_path = router_path
         self.namespace = namespace
@@ -125,6 +510,23 @@ class Extdirect(object):
         self.debug_mode = debug_mode
         self.actions = defaultdict(dict)
         self.json_encoder = json_encoder
+        self.filter_api_by_permission = filter_api_by_permission
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.enable_buffer = enable_buffer
+        self.max_retries = max_retries
+        self.client_timeout = client_timeout
+        self.adaptive_batching = adaptive_batching
+        self.slow_call_threshold = slow_call_threshold
+        self._latencies = dict()
+        self._slow_methods = set()
+        self.call_log = CallLogger(log_queue_size) if async_logging else None
+        self._api_cache = dict()
+        self.serializers = SerializerRegistry()
+        self._encoder_base = None
+        self._encoder = None
 
     def add_action(self, action_name, **settings):
         """
@@ -142,23 +544,47 @@ class Extdirect(object):
         ``metadata``: Metadata definition
         ``request_as_last_param``: If true, the wrapped callable will receive a request object
             as last argument
+        ``timeout``: Time budget of a call in seconds, True for the default budget
+        ``batched``: If set, declared as ``batched`` flag in API
 
         """
         callback_key = _mk_cb_key(action_name, settings['method_name'])
         self.actions[action_name][callback_key] = settings
+        self._api_cache.clear()
+
+    def add_serializer(self, type_, serializer):
+        """
+        Registers a serializer for ``type_`` (and its subclasses).
+
+        ``serializer`` is called with the object to encode and has to
+        return a JSON serializable representation of it.
+        """
+        self.serializers.add(type_, serializer)
 
-    def get_actions(self):
-        """ Builds and returns a dict of actions to be used in ExtDirect API """
+    def get_actions(self, permits=None):
+        """
+        Builds and returns a dict of actions to be used in ExtDirect API
+
+        If ``permits`` is passed, it's called with a method's callback key
+        and settings, methods it returns False for are left out.
+        """
         ret = {}
         for (key, val) in self.actions.items():
             items = []
-            for settings in val.values():
+            for (cb_key, settings) in val.items():
+                if permits is not None and not permits(cb_key, settings):
+                    continue
                 method_info = dict(
                     len=settings['numargs'],
                     name=settings['method_name']
                 )
                 if settings['accepts_files']:
                     method_info['formHandler'] = True
+                batched = settings.get('batched')
+                if batched is None and cb_key in self._slow_methods:
+                    batched = False
+                if batched is not None:
+                    method_info['batched'] = batched
                 meta = settings['metadata']
                 if meta:
                     if isinstance(meta, ExtListMetadata):
@@ -172,9 +598,63 @@ class Extdirect(object):
                             'strict': meta.strict
                         }
                 items.append(method_info)
-            ret[key] = items
+            if items:
+                ret[key] = items
         return ret
 
+    def get_permitted_actions(self, request):
+        """
+        Returns the actions the principals of ``request`` may call.
+
+        Permissions are checked against the same context the router
+        uses: methods of functions are checked against the root, the
+        results are cached per authenticated user id and set of effective
+        principals. Methods of classes are checked against a new class
+        instance on every call, since their ACL may depend on the request.
+        Classes whose constructor fails are left out.
+        """
+        # the user id is part of the key since security policies (as
+        # opposed to legacy authentication policies) don't provide
+        # effective principals
+        cache_key = (request.authenticated_userid,
+                     frozenset(request.effective_principals))
+        denied = self._api_cache.get(cache_key)
+        if denied is None:
+            context = request.root
+            denied = set()
+            for val in self.actions.values():
+                for (cb_key, settings) in val.items():
+                    permission = settings.get('permission')
+                    if settings['class'] is None and permission is not None \
+                            and not request.has_permission(permission, context):
+                        denied.add(cb_key)
+            denied = frozenset(denied)
+            if len(self._api_cache) >= API_CACHE_SIZE:
+                self._api_cache.clear()
+            self._api_cache[cache_key] = denied
+        instances = dict()
+
+        def permits(cb_key, settings):
+            klass = settings['class']
+            if klass is None:
+                return cb_key not in denied
+            permission = settings.get('permission')
+            if permission is None:
+                return True
+            if klass not in instances:
+                try:
+                    instances[klass] = klass(request)
+                except Exception: # pylint: disable=broad-except
+                    LOG.debug("Leaving out %s, instantiation failed", klass.__name__,
+                              exc_info=True)
+                    instances[klass] = None
+            instance = instances[klass]
+            if instance is None:
+                return False
+            return bool(request.has_permission(permission, instance))
+
+        return self.get_actions(permits)
+
     def get_method(self, action, method):
         """ Returns a method's settings """
         if action not in self.actions:
@@ -185,7 +665,10 @@ class Extdirect(object):
         return self.actions[action][key]
 
     def _get_api_dict(self, request):
-        all_actions = self.get_actions()
+        if self.filter_api_by_permission:
+            all_actions = self.get_permitted_actions(request)
+        else:
+            all_actions = self.get_actions()
         actions = dict()
         # filter returned actions in case there's an 'actions' request param
         if 'actions' in request.params:
@@ -196,12 +679,39 @@ class Extdirect(object):
         else:
             actions = all_actions
         # FIXME: use route_url instead of request.application_url + '/' + self.router_path,
-        return dict(
+        api = dict(
             url=request.application_url + '/' + self.router_path,
             type='remoting',
             namespace=self.namespace,
             actions=actions
         )
+        if self.enable_buffer is not None:
+            api['enableBuffer'] = self.enable_buffer
+        if self.max_retries is not None:
+            api['maxRetries'] = self.max_retries
+        if self.client_timeout is not None:
+            api['timeout'] = self.client_timeout
+        return api
+
+    def _record_latency(self, action_name, method_name, duration):
+        """
+        Updates the average call duration of a method and flags it as
+        slow (not batched) if it exceeds ``slow_call_threshold``
+        """
+        key = _mk_cb_key(action_name, method_name)
+        (count, avg) = self._latencies.get(key, (0, duration))
+        avg += LATENCY_AVG_WEIGHT * (duration - avg)
+        count += 1
+        self._latencies[key] = (count, avg)
+        if count < LATENCY_MIN_SAMPLES:
+            return
+        # use half the threshold to unflag methods, so a method
+        # close to the threshold doesn't toggle back and forth
+        if key in self._slow_methods:
+            if avg < self.slow_call_threshold / 2:
+                self._slow_methods.discard(key)
+        elif avg > self.slow_call_threshold:
+            self._slow_methods.add(key)
 
     def dump_api(self, request):
         """ Dumps all known remote methods """
@@ -211,24 +721,24 @@ class Extdirect(object):
             api=json.dumps(self._get_api_dict(request))
         )
 
-    def _do_route(self, action_name, method_name, params, metadata, trans_id, request):
-        """ Performs routing, i.e. calls decorated methods/functions """
+    def _get_pool(self):
+        """ Returns the thread pool running calls with time budget """
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = _WorkerPool(self.max_workers)
+        return self._pool
+
+    def _prepare_call(self, action_name, method_name, params, metadata, trans_id, request):
+        """ Resolves callback, arguments and permission of a call """
         if params is None:
             params = list()
         settings = self.get_method(action_name, method_name)
         permission = settings.get('permission', None)
-        ret = {
-            "type": "rpc",
-            "tid": trans_id,
-            "action": action_name,
-            "method": method_name,
-            "result": None
-        }
-
-        callback = settings['callback']
+        call = _Call(action_name, method_name, trans_id)
+        call.callback = settings['callback']
 
         append_request = settings.get('request_as_last_param', False)
-        permission_ok = True
         context = request.root
 
         prepend = []
@@ -242,15 +752,60 @@ class Extdirect(object):
         if settings['metadata']:
             prepend.append(metadata)
 
-        params = prepend + params
+        call.params = prepend + params
 
         if permission is not None:
-            permission_ok = has_permission(permission, context, request)
+            call.permission_ok = has_permission(permission, context, request)
+
+        timeout = settings.get('timeout')
+        if timeout is True:
+            timeout = self.timeout
+        call.timeout = timeout or None
+        return call
+
+    def _start_call(self, call, request):
+        """ Submits a call with time budget to the thread pool """
+        call.started = time.time()
+        call.deadline = call.started + call.timeout
+        call.task = self._get_pool().submit(_run_call, call, request)
+
+    def _invoke(self, call):
+        """ Runs a call or waits for its result until its deadline """
+        if not call.permission_ok:
+            raise AccessDeniedException("Access denied")
+        if call.task is None:
+            call.started = time.time()
+            try:
+                return call.callback(*call.params)
+            finally:
+                call.finished = time.time()
+        task = call.task
+        if not task.done.wait(max(0, call.deadline - time.time())):
+            # drop the call if it's still waiting for a worker
+            if task.cancel():
+                LOG.warning("%s.%s dropped, all %d workers are busy",
+                            call.action_name, call.method_name, self.max_workers)
+            raise CallTimeoutException(
+                "Call exceeded its time budget of {}s".format(call.timeout))
+        if task.exception is not None:
+            raise task.exception
+        return task.result
+
+    def _finish_call(self, call, request):
+        """ Runs a prepared call and builds its response """
+        action_name = call.action_name
+        method_name = call.method_name
+        trans_id = call.trans_id
+        ret = {
+            "type": "rpc",
+            "tid": trans_id,
+            "action": action_name,
+            "method": method_name,
+            "result": None
+        }
 
         try:
-            if not permission_ok:
-                raise AccessDeniedException("Access denied")
-            ret["result"] = callback(*params)
+            ret["result"] = self._invoke(call)
         except Exception as exc:
             ret["type"] = "exception"
             # Let a user defined view for specific exception prevent returning
@@ -261,8 +816,11 @@ class Extdirect(object):
                 return ret
 
             # Log Error
-            LOG.error("%s: %s", str(exc.__class__.__name__), exc)
-            LOG.info(traceback.format_exc())
+            if self.call_log is not None:
+                self.call_log.error(action_name, method_name, trans_id, sys.exc_info())
+            else:
+                LOG.error("%s: %s", str(exc.__class__.__name__), exc)
+                LOG.info(traceback.format_exc())
 
             if self.expose_exceptions:
                 ret["result"] = {
@@ -283,7 +841,6 @@ class Extdirect(object):
                 # and include the url to access it in the ext direct Exception response text
                 from pyramid_debugtoolbar.tbtools import get_traceback
                 from pyramid_debugtoolbar.utils import EXC_ROUTE_NAME
-                import sys
                 exc_history = request.exc_history
                 if exc_history is not None:
                     tb = get_traceback(
@@ -300,6 +857,19 @@ class Extdirect(object):
                     ret['message'] = 'Exception: traceback url: {}'.format(exc_url)
         return ret
 
+    def _dumps(self, data):
+        """ Serializes ``data`` using the configured json encoder """
+        encoder = self.json_encoder
+        if isinstance(encoder, type) and issubclass(encoder, JsonReprEncoder):
+            # derive a subclass bound to our serializers once, this way
+            # the encoder's constructor signature stays untouched
+            if self._encoder_base is not encoder:
+                self._encoder = type(encoder.__name__, (encoder,),
+                                     dict(serializers=self.serializers))
+                self._encoder_base = encoder
+            encoder = self._encoder
+        return json.dumps(data, cls=encoder)
+
     def route(self, request):
         """ Route a request to the corresponding action method """
         is_form_data = is_form_submit(request)
@@ -307,16 +877,39 @@ class Extdirect(object):
             data = parse_extdirect_form_submit(request)
         else:
             data = parse_extdirect_request(request)
-        ret = []
-        for (act, meth, params, metadata, tid) in data:
-            ret.append(self._do_route(act, meth, params, metadata, tid, request))
+        calls = [self._prepare_call(act, meth, params, metadata, tid, request)
+                 for (act, meth, params, metadata, tid) in data]
+        # calls with time budget run concurrently, so the batch waits
+        # at most for the longest budget
+        for call in calls:
+            if call.timeout and call.permission_ok:
+                self._start_call(call, request)
+        ret = [None] * len(calls)
+        durations = [0] * len(calls)
+        inline = [i for (i, call) in enumerate(calls) if call.task is None]
+        budgeted = [i for (i, call) in enumerate(calls) if call.task is not None]
+        for index in inline + budgeted:
+            call = calls[index]
+            ret[index] = self._finish_call(call, request)
+            now = time.time()
+            durations[index] = (call.finished or now) - (call.started or now)
+            # calls that never ran (e.g. denied ones) say nothing about latency
+            if self.adaptive_batching and call.started is not None:
+                self._record_latency(call.action_name, call.method_name, durations[index])
+        # every call is serialized on its own, this way its size
+        # is known without encoding it twice
+        parts = [self._dumps(call) for call in ret]
         if not is_form_data:
-            if len(ret) == 1:
-                ret = ret[0]
-            return (json.dumps(ret, cls=self.json_encoder), False)
-        ret = ret[0] # form data cannot be batched
-        form_data = json.dumps(ret, cls=self.json_encoder).replace("&quot;", r"\&quot;")
-        return (FORM_SUBMIT_RESPONSE_TPL.format(form_data), True)
+            body = parts[0] if len(parts) == 1 else '[' + ', '.join(parts) + ']'
+        else:
+            # form data cannot be batched
+            form_data = parts[0].replace("&quot;", r"\&quot;")
+            body = FORM_SUBMIT_RESPONSE_TPL.format(form_data)
+        if self.call_log is not None:
+            for (call, part, duration) in zip(ret, parts, durations):
+                self.call_log.access(call['action'], call['method'], call['tid'],
+                                     duration, len(part), call['type'])
+        return (body, is_form_data)
 
 
 class ExtMetadata(object):
@@ -360,7 +953,10 @@ class extdirect_method(object): # pylint: disable=invalid-name, too-few-public-m
             permission=None,
             accepts_files=False,
             metadata=None,
-            request_as_last_param=False):
+            request_as_last_param=False,
+            timeout=None,
+            batched=None,
+            provider=None):
         if metadata and not isinstance(metadata, ExtMetadata):
             raise ValueError("Metadata must be an instance of either ExtListMetadata or ExtDictMetadata")
         self.info = None
@@ -371,6 +967,9 @@ class extdirect_method(object): # pylint: disable=invalid-name, too-few-public-m
             accepts_files=accepts_files,
             metadata=metadata,
             request_as_last_param=request_as_last_param,
+            timeout=timeout,
+            batched=batched,
+            provider=provider,
             original_name=None
         )
 
@@ -425,6 +1024,7 @@ class extdirect_method(object): # pylint: disable=invalid-name, too-few-public-m
         action = settings.pop("action", None)
         if action is not None:
             name = action
+        provider = settings.pop("provider", None)
 
         if class_context:
             class_settings = getattr(obj, '__extdirect_settings__', None)
@@ -434,8 +1034,16 @@ class extdirect_method(object): # pylint: disable=invalid-name, too-few-public-m
                 if settings.get("permission") is None:
                     permission = class_settings.get("default_permission")
                     settings["permission"] = permission
-
-        extdirect = scanner.config.registry.getUtility(IExtdirect)
+                if provider is None:
+                    provider = class_settings.get("default_provider")
+
+        if provider:
+            extdirect = scanner.config.registry.queryUtility(IExtdirect, name=provider)
+            if extdirect is None:
+                raise ValueError("{} uses undeclared provider '{}'".format(
+                    settings['original_name'], provider))
+        else:
+            extdirect = scanner.config.registry.getUtility(IExtdirect)
         extdirect.add_action(name, callback=callback, **settings)
 
 
@@ -484,47 +1092,100 @@ def parse_extdirect_request(request):
     return ret
 
 
-def api_view(request):
+def api_view(request, provider=''):
     """ Renders the API """
-    extdirect = request.registry.getUtility(IExtdirect)
+    extdirect = request.registry.getUtility(IExtdirect, name=provider)
     body = extdirect.dump_api(request)
     return Response(body, content_type='text/javascript', charset='UTF-8')
 
 
-def router_view(request):
+def router_view(request, provider=''):
     """ Renders the result of a ExtDirect call """
-    extdirect = request.registry.getUtility(IExtdirect)
+    extdirect = request.registry.getUtility(IExtdirect, name=provider)
     (body, is_form_data) = extdirect.route(request)
     ctype = 'text/html' if is_form_data else 'application/json'
     return Response(body, content_type=ctype, charset='UTF-8')
 
 
-def includeme(config):
-    """ Let extdirect be included by config.include(). """
-    settings = config.registry.settings
-    extdirect_config = dict()
-    names = ("api_path", "router_path", "namespace", "descriptor",
-             "expose_exceptions", "debug_mode", "json_encoder")
-    for name in names:
-        qname = "pyramid_extdirect.{}".format(name)
-        value = settings.get(qname, None)
-        if name == "expose_exceptions" or name == "debug_mode":
+def _read_settings(settings, prefix):
+    """ Reads and converts all settings starting with ``prefix`` """
+    ret = dict()
+    for name in SETTING_NAMES:
+        value = settings.get(prefix + name, None)
+        if value is None:
+            continue
+        if name in BOOL_SETTINGS:
             value = (value == "true")
         if name == "json_encoder" and value:
             from pyramid.path import DottedNameResolver
             resolver = DottedNameResolver()
             value = resolver.resolve(value)
-        if value is not None:
-            extdirect_config[name] = value
+        if name in INT_SETTINGS and value:
+            value = int(value)
+        if name in FLOAT_SETTINGS and value:
+            value = float(value)
+        if name == "enable_buffer" and value:
+            # either a number of milliseconds or true/false
+            value = int(value) if value.isdigit() else (value == "true")
+        ret[name] = value
+    return ret
+
+
+def _add_provider(config, extd, name, prefix):
+    """ Registers a provider utility along with its API and router views """
+    settings = config.registry.settings
+    config.registry.registerUtility(extd, IExtdirect, name=name)
+    suffix = '-' + name if name else ''
+
+    def provider_api_view(request):
+        """ Renders the API of this provider """
+        return api_view(request, name)
+
+    def provider_router_view(request):
+        """ Renders the result of a ExtDirect call to this provider """
+        return router_view(request, name)
 
-    extd = Extdirect(**extdirect_config)
-    config.registry.registerUtility(extd, IExtdirect)
+    api_view_perm = settings.get(prefix + "api_view_permission",
+                                 settings.get("pyramid_extdirect.api_view_permission"))
+    config.add_route('extapi' + suffix, extd.api_path)
+    config.add_view(provider_api_view, route_name='extapi' + suffix,
+                    permission=api_view_perm)
 
-    api_view_perm = settings.get("pyramid_extdirect.api_view_permission")
-    config.add_route('extapi', extd.api_path)
-    config.add_view(api_view, route_name='extapi', permission=api_view_perm)
+    router_view_perm = settings.get(prefix + "router_view_permission",
+                                    settings.get("pyramid_extdirect.router_view_permission"))
+    config.add_route('extrouter' + suffix, extd.router_path)
+    config.add_view(provider_router_view, route_name='extrouter' + suffix,
+                    permission=router_view_perm)
 
-    router_view_perm = settings.get("pyramid_extdirect.router_view_permission")
-    config.add_route('extrouter', extd.router_path)
-    config.add_view(router_view, route_name='extrouter', permission=router_view_perm)
 
+def includeme(config):
+    """
+    Let extdirect be included by config.include().
+
+    Besides the default provider, additional named providers can be
+    listed in ``pyramid_extdirect.providers``. Each of them gets its own
+    API and router views, settings are inherited from the default
+    provider and can be overridden using ``pyramid_extdirect.<name>.<setting>``.
+    """
+    from pyramid.settings import aslist
+    settings = config.registry.settings
+    extdirect_config = dict((name, False) for name in BOOL_SETTINGS)
+    extdirect_config.update(_read_settings(settings, "pyramid_extdirect."))
+    _add_provider(config, Extdirect(**extdirect_config), '', "pyramid_extdirect.")
+
+    for name in aslist(settings.get("pyramid_extdirect.providers", "")):
+        if not PROVIDER_NAME_RE.match(name):
+            # the name is used in the JS API descriptor
+            raise ValueError("Invalid provider name '{}', it has to be "
+                             "a valid identifier".format(name))
+        prefix = "pyramid_extdirect.{}.".format(name)
+        provider_config = dict(extdirect_config)
+        provider_config.update(
+            api_path="extdirect-{}-api.js".format(name),
+            router_path="extdirect-{}-router".format(name)
+        )
+        provider_config.update(_read_settings(settings, prefix))
+        if prefix + "descriptor" not in settings:
+            provider_config["descriptor"] = "{}.REMOTING_API_{}".format(
+                provider_config.get("namespace", "Ext.app"), name.upper())
+        _add_provider(config, Extdirect(**provider_config), name, prefix)
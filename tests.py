@@ -23,6 +23,10 @@ class TestPyramidExtDirect(unittest.TestCase):
         self.config.end()
 
     def tearDown(self):
+        from pyramid_extdirect import IExtdirect
+        for (name, util) in self.config.registry.getUtilitiesFor(IExtdirect):
+            if util._pool is not None:
+                util._pool.shutdown()
         testing.tearDown()
 
     def _get_util(self):
@@ -227,3 +231,509 @@ class TestPyramidExtDirect(unittest.TestCase):
         self.assertNotIn('"MyAction": [{"name": "my_foo", "len": 1}]', result)
         self.assertIn('"OtherAction": [{"name": "bar", "len": 2}]', result)
         self.assertNotIn('"UploadAction": [{"formHandler": true, "name": "upload", "len": 1}]}', result)
+
+    def test_api_filtered_by_permission(self):
+        dec = self._makeOne(action='MyAction', permission='admin')
+        def secret(): pass
+        decorated_secret = dec(secret)
+        dec.register(self, 'secret', secret)
+
+        dec2 = self._makeOne(action='OtherAction')
+        def bar(one, two): pass
+        decorated_bar = dec2(bar)
+        dec2.register(self, 'bar', bar)
+
+        self.config.testing_securitypolicy(userid='bob', permissive=False)
+        util = self._get_util()
+        util.filter_api_by_permission = True
+        request = testing.DummyRequest()
+        request.registry = self.config.registry
+        request.root = Dummy()
+        actions = util._get_api_dict(request)['actions']
+        self.assertNotIn('MyAction', actions)
+        self.assertEqual(actions['OtherAction'], [{'name': 'bar', 'len': 2}])
+        self.assertEqual(len(util._api_cache), 1)
+
+        util._get_api_dict(request)
+        self.assertEqual(len(util._api_cache), 1)
+
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        actions = util._get_api_dict(request)['actions']
+        self.assertEqual(actions['MyAction'], [{'name': 'secret', 'len': 0}])
+        self.assertEqual(len(util._api_cache), 2)
+
+    def test_api_filtered_by_instance_permission(self):
+        from pyramid.interfaces import IAuthorizationPolicy
+        dec = self._makeOne(action='Docs', permission='edit')
+        class Docs(object):
+            def __init__(self, request):
+                self.allowed = request.params.get('owner') == 'bob'
+            @dec
+            def save(self):
+                pass
+        dec.register(self, 'save', Docs)
+
+        class ContextPolicy(object):
+            def permits(self, context, principals, permission):
+                return getattr(context, 'allowed', False)
+
+        self.config.testing_securitypolicy(userid='bob')
+        self.config.registry.registerUtility(ContextPolicy(), IAuthorizationPolicy)
+        util = self._get_util()
+        util.filter_api_by_permission = True
+
+        request = testing.DummyRequest(params={'owner': 'bob'})
+        request.registry = self.config.registry
+        request.root = Dummy()
+        actions = util._get_api_dict(request)['actions']
+        self.assertEqual(actions['Docs'], [{'name': 'save', 'len': 0}])
+
+        request = testing.DummyRequest(params={'owner': 'alice'})
+        request.registry = self.config.registry
+        request.root = Dummy()
+        actions = util._get_api_dict(request)['actions']
+        self.assertNotIn('Docs', actions)
+
+    def test_api_filtered_leaves_out_failing_classes(self):
+        dec = self._makeOne(action='Broken', permission='view')
+        class Broken(object):
+            def __init__(self, request):
+                request.json_body
+            @dec
+            def load(self):
+                pass
+        dec.register(self, 'load', Broken)
+
+        dec2 = self._makeOne(action='OtherAction')
+        def bar(one, two): pass
+        dec2(bar)
+        dec2.register(self, 'bar', bar)
+
+        self.config.testing_securitypolicy(userid='bob')
+        util = self._get_util()
+        util.filter_api_by_permission = True
+        request = testing.DummyRequest()
+        request.registry = self.config.registry
+        request.root = Dummy()
+        actions = util._get_api_dict(request)['actions']
+        self.assertNotIn('Broken', actions)
+        self.assertEqual(actions['OtherAction'], [{'name': 'bar', 'len': 2}])
+
+    def test_api_filter_cache_per_userid(self):
+        dec = self._makeOne(action='MyAction', permission='admin')
+        def secret(): pass
+        dec(secret)
+        dec.register(self, 'secret', secret)
+
+        util = self._get_util()
+        util.filter_api_by_permission = True
+        request = Dummy()
+        request.root = Dummy()
+        # security policies may provide the same principals for everyone
+        request.effective_principals = ['system.Everyone']
+        request.authenticated_userid = 'bob'
+        request.has_permission = lambda perm, context: False
+        self.assertNotIn('MyAction', util.get_permitted_actions(request))
+
+        request.authenticated_userid = 'admin'
+        request.has_permission = lambda perm, context: True
+        self.assertIn('MyAction', util.get_permitted_actions(request))
+
+    def test_serializers(self):
+        import datetime
+        import decimal
+
+        class Money(object):
+            def __init__(self, amount):
+                self.amount = amount
+
+        class Euro(Money):
+            pass
+
+        class WithRepr(object):
+            def json_repr(self):
+                return 'repr'
+
+        dec = self._makeOne(action='SerialAction')
+        def foo():
+            return [
+                datetime.date(2020, 1, 2),
+                decimal.Decimal('0.10'),
+                Euro(3),
+                WithRepr(),
+            ]
+        decorated = dec(foo)
+        dec.register(self, 'foo', foo)
+
+        util = self._get_util()
+        util.add_serializer(Money, lambda obj: {'amount': obj.amount})
+        body = b"""{"action": "SerialAction", "method": "foo", "data":null, "tid":0}"""
+        request = DummyAjaxRequest(body=body)
+        response, is_form_data = util.route(request)
+        self.assertIn(
+            '"result": ["2020-01-02", "0.10", {"amount": 3}, "repr"]',
+            response)
+        self.assertIs(util.serializers.get(Euro), util.serializers.get(Money))
+
+    def test_serializers_custom_encoder(self):
+        import datetime
+        import json
+        from pyramid_extdirect import JsonReprEncoder
+
+        class MyEncoder(JsonReprEncoder):
+            def __init__(self, skipkeys=False, ensure_ascii=True,
+                         check_circular=True, allow_nan=True, sort_keys=False,
+                         indent=None, separators=None, default=None):
+                super(MyEncoder, self).__init__(sort_keys=True)
+
+        dec = self._makeOne(action='SerialAction')
+        def foo():
+            return {'b': datetime.date(2020, 1, 2), 'a': 1}
+        decorated = dec(foo)
+        dec.register(self, 'foo', foo)
+
+        util = self._get_util()
+        util.json_encoder = MyEncoder
+        body = b"""{"action": "SerialAction", "method": "foo", "data":null, "tid":0}"""
+        request = DummyAjaxRequest(body=body)
+        response, is_form_data = util.route(request)
+        self.assertIn('"result": {"a": 1, "b": "2020-01-02"}', response)
+        self.assertIsNone(MyEncoder.serializers)
+
+    def test_unserializable_result(self):
+        dec = self._makeOne(action='SerialAction')
+        def foo():
+            return Dummy()
+        decorated = dec(foo)
+        dec.register(self, 'foo', foo)
+
+        util = self._get_util()
+        body = b"""{"action": "SerialAction", "method": "foo", "data":null, "tid":0}"""
+        request = DummyAjaxRequest(body=body)
+        self.assertRaises(TypeError, util.route, request)
+
+    def test_call_timeout(self):
+        import json
+        import threading
+        from pyramid_extdirect import current_deadline
+
+        release = threading.Event()
+        dec = self._makeOne(action='SlowAction', timeout=0.05)
+        def slow():
+            release.wait(10)
+        decorated = dec(slow)
+        dec.register(self, 'slow', slow)
+
+        dec2 = self._makeOne(action='FastAction', timeout=10)
+        def fast():
+            return current_deadline() is not None
+        decorated = dec2(fast)
+        dec2.register(self, 'fast', fast)
+
+        util = self._get_util()
+        body = b"""[{"action": "SlowAction", "method": "slow", "data":null, "tid":0},
+                    {"action": "FastAction", "method": "fast", "data":null, "tid":1}]"""
+        request = DummyAjaxRequest(body=body)
+        try:
+            response, is_form_data = util.route(request)
+        finally:
+            release.set()
+        (slow_ret, fast_ret) = json.loads(response)
+        self.assertEqual(slow_ret['type'], 'exception')
+        self.assertEqual(slow_ret['tid'], 0)
+        self.assertEqual(slow_ret['result']['message'], 'Error executing SlowAction.slow')
+        self.assertEqual(fast_ret['type'], 'rpc')
+        self.assertEqual(fast_ret['result'], True)
+
+    def test_call_timeouts_run_concurrently(self):
+        import json
+        import threading
+        import time
+
+        release = threading.Event()
+        dec = self._makeOne(action='SlowAction', timeout=0.5)
+        def slow():
+            release.wait(10)
+        dec(slow)
+        dec.register(self, 'slow', slow)
+
+        dec2 = self._makeOne(action='SlowAction', timeout=True)
+        def slower():
+            release.wait(10)
+        dec2(slower)
+        dec2.register(self, 'slower', slower)
+
+        util = self._get_util()
+        util.timeout = 0.5
+        body = b"""[{"action": "SlowAction", "method": "slow", "data":null, "tid":0},
+                    {"action": "SlowAction", "method": "slower", "data":null, "tid":1}]"""
+        request = DummyAjaxRequest(body=body)
+        started = time.time()
+        try:
+            response, is_form_data = util.route(request)
+        finally:
+            release.set()
+        # both budgets run at the same time instead of adding up to 1s
+        self.assertLess(time.time() - started, 0.95)
+        result = json.loads(response)
+        self.assertEqual([r['type'] for r in result], ['exception', 'exception'])
+        self.assertEqual([r['tid'] for r in result], [0, 1])
+
+    def test_call_dropped_when_workers_busy(self):
+        import json
+        import threading
+
+        release = threading.Event()
+        dec = self._makeOne(action='SlowAction', timeout=0.1)
+        def slow():
+            release.wait(10)
+        dec(slow)
+        dec.register(self, 'slow', slow)
+
+        util = self._get_util()
+        util.max_workers = 1
+        body = b"""[{"action": "SlowAction", "method": "slow", "data":null, "tid":0},
+                    {"action": "SlowAction", "method": "slow", "data":null, "tid":1}]"""
+        request = DummyAjaxRequest(body=body)
+        try:
+            with self.assertLogs('pyramid_extdirect', 'WARNING') as logs:
+                response, is_form_data = util.route(request)
+        finally:
+            release.set()
+        self.assertEqual([r['type'] for r in json.loads(response)],
+                         ['exception', 'exception'])
+        self.assertTrue(any('SlowAction.slow dropped, all 1 workers are busy' in line
+                            for line in logs.output))
+
+    def test_call_without_timeout(self):
+        from pyramid_extdirect import current_deadline
+        dec = self._makeOne(action='SimpleAction')
+        def foo():
+            return current_deadline()
+        decorated = dec(foo)
+        dec.register(self, 'foo', foo)
+
+        util = self._get_util()
+        # the default budget only applies to methods opting in
+        util.timeout = 5
+        body = b"""{"action": "SimpleAction", "method": "foo", "data":null, "tid":0}"""
+        request = DummyAjaxRequest(body=body)
+        response, is_form_data = util.route(request)
+        self.assertIn('"result": null', response)
+
+    def test_batching_hints(self):
+        dec = self._makeOne(action='ReportAction', batched=False)
+        def report(): pass
+        decorated = dec(report)
+        dec.register(self, 'report', report)
+
+        util = self._get_util()
+        util.enable_buffer = 20
+        util.max_retries = 0
+        util.client_timeout = 30000
+        request = testing.DummyRequest()
+        api = util._get_api_dict(request)
+        self.assertEqual(api['actions']['ReportAction'],
+                         [{'name': 'report', 'len': 0, 'batched': False}])
+        self.assertEqual(api['enableBuffer'], 20)
+        self.assertEqual(api['maxRetries'], 0)
+        self.assertEqual(api['timeout'], 30000)
+
+    def test_adaptive_batching(self):
+        from pyramid_extdirect import LATENCY_MIN_SAMPLES
+        dec = self._makeOne(action='SimpleAction')
+        def foo(): pass
+        decorated = dec(foo)
+        dec.register(self, 'foo', foo)
+
+        util = self._get_util()
+        util.adaptive_batching = True
+        for i in range(LATENCY_MIN_SAMPLES - 1):
+            util._record_latency('SimpleAction', 'foo', 2.0)
+        self.assertNotIn('batched', util.get_actions()['SimpleAction'][0])
+        util._record_latency('SimpleAction', 'foo', 2.0)
+        self.assertEqual(util.get_actions()['SimpleAction'][0]['batched'], False)
+        for i in range(20):
+            util._record_latency('SimpleAction', 'foo', 0.01)
+        self.assertNotIn('batched', util.get_actions()['SimpleAction'][0])
+
+        body = b"""{"action": "SimpleAction", "method": "foo", "data":null, "tid":0}"""
+        util.route(DummyAjaxRequest(body=body))
+        self.assertEqual(util._latencies['SimpleAction#foo'][0], 31)
+
+    def test_adaptive_batching_skips_denied_calls(self):
+        dec = self._makeOne(action='SimpleAction', permission='admin')
+        def foo(): pass
+        dec(foo)
+        dec.register(self, 'foo', foo)
+
+        self.config.testing_securitypolicy(userid='bob', permissive=False)
+        util = self._get_util()
+        util.adaptive_batching = True
+        body = b"""{"action": "SimpleAction", "method": "foo", "data":null, "tid":0}"""
+        request = DummyAjaxRequest(body=body)
+        request.registry = self.config.registry
+        response, is_form_data = util.route(request)
+        self.assertIn('"type": "exception"', response)
+        self.assertNotIn('SimpleAction#foo', util._latencies)
+
+    def test_async_logging(self):
+        import json
+        import logging
+        from pyramid_extdirect import CallLogger
+
+        dec = self._makeOne(action='SimpleAction')
+        def foo():
+            return 'Heya!'
+        def broken():
+            raise ValueError('broken')
+        dec(foo)
+        dec.register(self, 'foo', foo)
+        dec2 = self._makeOne(action='SimpleAction')
+        dec2(broken)
+        dec2.register(self, 'broken', broken)
+
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+        handler = Handler()
+        logger = logging.getLogger('pyramid_extdirect')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            util = self._get_util()
+            util.call_log = CallLogger()
+            body = b"""[{"action": "SimpleAction", "method": "foo", "data":null, "tid":0},
+                        {"action": "SimpleAction", "method": "broken", "data":null, "tid":1}]"""
+            response, is_form_data = util.route(DummyAjaxRequest(body=body))
+            util.call_log.queue.join()
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+
+        access = [r for r in records if r.name == 'pyramid_extdirect.calls']
+        self.assertEqual([(r.method, r.tid, r.outcome) for r in access],
+                         [('foo', 0, 'rpc'), ('broken', 1, 'exception')])
+        calls = json.loads(response)
+        self.assertEqual([r.size for r in access],
+                         [len(json.dumps(call)) for call in calls])
+        self.assertEqual(sum(r.size for r in access) + 4, len(response))
+        errors = [r for r in records if r.levelno == logging.ERROR]
+        self.assertEqual(errors[0].getMessage(), 'ValueError: broken')
+        self.assertTrue(any('Traceback' in r.getMessage() for r in records))
+
+    def test_async_logging_drops_records(self):
+        import threading
+        from pyramid_extdirect import CallLogger
+        call_log = CallLogger(maxsize=1)
+        # pretend the background thread is running, so nothing is consumed
+        call_log._thread = threading.current_thread()
+        call_log.access('SimpleAction', 'foo', 0, 0.1, 10, 'rpc')
+        call_log.access('SimpleAction', 'foo', 1, 0.1, 10, 'rpc')
+        self.assertEqual(call_log.queue.qsize(), 1)
+        self.assertEqual(call_log.dropped, 1)
+
+    def test_async_logging_counts_failures(self):
+        from pyramid_extdirect import CallLogger
+        call_log = CallLogger()
+        # an unusable exc_info makes emitting the record fail
+        call_log.error('SimpleAction', 'foo', 0, None)
+        call_log.queue.join()
+        self.assertEqual(call_log.failed, 1)
+
+    def test_providers(self):
+        from pyramid_extdirect import IExtdirect, includeme, api_view
+        from webob import Request
+        testing.tearDown()
+        self.config = testing.setUp(settings={
+            'pyramid_extdirect.providers': 'reports',
+            'pyramid_extdirect.reports.namespace': 'Reports',
+            'pyramid_extdirect.reports.timeout': '5',
+        })
+        includeme(self.config)
+
+        dec = self._makeOne(action='ReportAction', provider='reports')
+        def report():
+            return 'report'
+        dec(report)
+        dec.register(self, 'report', report)
+
+        dec2 = self._makeOne(action='SimpleAction')
+        def foo(): pass
+        dec2(foo)
+        dec2.register(self, 'foo', foo)
+
+        registry = self.config.registry
+        default = registry.getUtility(IExtdirect)
+        reports = registry.getUtility(IExtdirect, name='reports')
+        self.assertEqual(list(default.actions), ['SimpleAction'])
+        self.assertEqual(list(reports.actions), ['ReportAction'])
+        self.assertEqual(reports.router_path, 'extdirect-reports-router')
+        self.assertEqual(reports.descriptor, 'Reports.REMOTING_API_REPORTS')
+        self.assertEqual(reports.timeout, 5.0)
+        self.assertEqual(default.timeout, None)
+
+        # an application's own route with a hyphenated name
+        self.config.add_route('my-api', '/my-api.js')
+        self.config.add_view(api_view, route_name='my-api')
+        app = self.config.make_wsgi_app()
+
+        response = Request.blank('/extdirect-reports-api.js').get_response(app)
+        self.assertIn('Reports.REMOTING_API_REPORTS', response.text)
+        self.assertIn('"ReportAction"', response.text)
+        self.assertNotIn('"SimpleAction"', response.text)
+
+        response = Request.blank('/my-api.js').get_response(app)
+        self.assertIn('"SimpleAction"', response.text)
+        self.assertNotIn('"ReportAction"', response.text)
+
+        body = b"""{"action": "ReportAction", "method": "report", "data":null, "tid":0}"""
+        response = Request.blank('/extdirect-reports-router', POST=body).get_response(app)
+        self.assertIn('"result": "report"', response.text)
+
+    def test_default_provider(self):
+        from pyramid_extdirect import IExtdirect, includeme
+        testing.tearDown()
+        self.config = testing.setUp(settings={
+            'pyramid_extdirect.providers': 'reports',
+        })
+        includeme(self.config)
+
+        dec = self._makeOne()
+        class Reports(object):
+            __extdirect_settings__ = {
+                'default_action_name': 'Reports',
+                'default_provider': 'reports',
+            }
+            def __init__(self, request):
+                self.request = request
+            @dec
+            def load(self):
+                pass
+        dec.register(self, 'Reports', Reports)
+
+        registry = self.config.registry
+        self.assertEqual(list(registry.getUtility(IExtdirect).actions), [])
+        reports = registry.getUtility(IExtdirect, name='reports')
+        self.assertEqual(list(reports.actions), ['Reports'])
+
+    def test_undeclared_provider(self):
+        dec = self._makeOne(action='ReportAction', provider='reports')
+        def report(): pass
+        dec(report)
+        self.assertRaisesRegexp(
+            ValueError,
+            "report uses undeclared provider 'reports'",
+            dec.register, self, 'report', report)
+
+    def test_invalid_provider_name(self):
+        from pyramid_extdirect import includeme
+        testing.tearDown()
+        self.config = testing.setUp(settings={
+            'pyramid_extdirect.providers': 'my-reports',
+        })
+        self.assertRaisesRegexp(
+            ValueError,
+            "Invalid provider name 'my-reports'",
+            includeme, self.config)